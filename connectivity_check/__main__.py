@@ -1,6 +1,8 @@
 import argparse
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
+
 from . import core
 from .aws import awslambda, ecs, rds, security_groups
 
@@ -27,6 +29,7 @@ arg_parser.add_argument("--toRDS",
 arg_parser.add_argument("--port",
                         metavar="PORT_NUMBER",
                         dest='port',
+                        type=int,
                         default=5432,
                         help="""The port number used for connections. If omitted, defaults to 5432
                                 """)
@@ -37,12 +40,19 @@ svc_to = None
 
 print("loading service information")
 try:
-    if args.fromECS:
-        svc_from = ecs.lookup_from(args.fromECS)
-    if args.fromLambda:
-        svc_from = awslambda.lookup_from(args.fromLambda)
-    if args.toRDS:
-        svc_to = rds.lookup_to(args.toRDS)
+    # the from and to lookups are independent, and dominated by AWS API latency, so
+    # are run concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        from_future = None
+        to_future = None
+        if args.fromECS:
+            from_future = executor.submit(ecs.lookup_from, args.fromECS)
+        if args.fromLambda:
+            from_future = executor.submit(awslambda.lookup_from, args.fromLambda)
+        if args.toRDS:
+            to_future = executor.submit(rds.lookup_to, args.toRDS)
+        svc_from = from_future and from_future.result()
+        svc_to = to_future and to_future.result()
 except:
     print(sys.exc_info()[1])
     sys.exit(2)
@@ -59,6 +69,7 @@ else:
     sys.exit(3)
     
 print("checking security groups")
+security_groups.prefetch(svc_from.security_group_ids + svc_to.security_group_ids)
 from_sg_rules = security_groups.lookup(svc_from.security_group_ids)
 to_sg_rules = security_groups.lookup(svc_to.security_group_ids)
 analysis = from_sg_rules.can_connect_to(svc_from.cidr, svc_to.cidr, args.port, to_sg_rules)
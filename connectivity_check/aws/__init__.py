@@ -0,0 +1,61 @@
+""" Modules that retrieve information about AWS resources.
+    """
+
+import functools
+import socket
+import struct
+import threading
+
+from concurrent.futures import Future
+
+
+def memoize(fn):
+    """ Caches the result of a single-argument lookup function for the life of
+        the process. Unlike lru_cache, concurrent calls with the same argument
+        wait for the first call to complete, rather than each making their own
+        AWS requests.
+        """
+    lock = threading.Lock()
+    futures = {}
+
+    @functools.wraps(fn)
+    def wrapper(arg):
+        with lock:
+            future = futures.get(arg)
+            is_owner = future is None
+            if is_owner:
+                future = futures[arg] = Future()
+        if is_owner:
+            try:
+                future.set_result(fn(arg))
+            except BaseException as ex:
+                future.set_exception(ex)
+        return future.result()
+
+    wrapper.cache_clear = futures.clear
+    return wrapper
+
+
+# indexed by prefix length
+_NETMASKS = tuple((0xFFFFFFFF << (32 - n)) & 0xFFFFFFFF for n in range(33))
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_ipv4(cidr):
+    """ Converts an IPv4 CIDR string into a (network, netmask) pair of integers, so
+        that containment can be tested with bitwise operations. A bare address is
+        treated as a /32.
+
+        This is done with socket.inet_aton rather than the ipaddress module, which
+        constructs several intermediate objects in pure Python for each parse.
+
+        Results are cached: the same CIDRs (such as 0.0.0.0/0, or the VPC's own
+        block) appear in many rules, and each connection check parses its source
+        and destination.
+        """
+    addr, _, prefixlen = cidr.partition('/')
+    prefixlen = int(prefixlen) if prefixlen else 32
+    if not 0 <= prefixlen <= 32:
+        raise ValueError(f"invalid IPv4 prefix length: {cidr}")
+    mask = _NETMASKS[prefixlen]
+    return struct.unpack('!I', socket.inet_aton(addr))[0] & mask, mask
@@ -0,0 +1,38 @@
+""" Provides boto3 clients for the other modules in this package. All clients are
+    created from a single session, so credentials and endpoint data are resolved
+    once per process rather than once per client.
+
+    boto3 is imported when the first client is requested, not when this module is
+    loaded; importing it takes a noticeable fraction of a second, which is wasted
+    if the program exits due to --help or invalid arguments.
+    """
+
+import threading
+
+from functools import lru_cache
+
+
+_session = None
+
+# clients are thread-safe once created, but creating them is not, and lookups
+# may run concurrently
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=8)
+def client(service_name):
+    global _session
+    with _lock:
+        if _session is None:
+            import boto3
+            _session = boto3.session.Session()
+        return _session.client(service_name)
+
+
+def paginate(service_name, operation_name, result_key, **kwargs):
+    """ Invokes a paginated operation and yields the items under result_key from
+        every page, so that large accounts don't silently lose results after
+        the first page.
+        """
+    for page in client(service_name).get_paginator(operation_name).paginate(**kwargs):
+        yield from page[result_key]
@@ -2,12 +2,10 @@
     is a reserved word in Python.
     """
 
-import boto3
-
 from collections import namedtuple
-from functools import lru_cache
 
 from ..core import FromInfo
+from ._clients import client
 from .vpc import lookup as vpc_lookup
 
 
@@ -15,7 +13,7 @@ def lookup_from(lambda_name):
     """ This is the entry point for retrieving information about Lambda as a source.
         It may be passed the function's name or ARN.
         """
-    lambda_config = _lambda_client().get_function(FunctionName=lambda_name)['Configuration']
+    lambda_config = client('lambda').get_function(FunctionName=lambda_name)['Configuration']
     vpc_config = lambda_config.get('VpcConfig')
     if vpc_config:
         vpc_id = vpc_config.get('VpcId')
@@ -27,12 +25,3 @@ def lookup_from(lambda_name):
         # TODO - support for non-VPC Lambdas
         raise Exception("this tool does not currently support Lambdas that don't run in a VPC")
     return FromInfo("lambda", lambda_config['FunctionName'], vpc, subnet_ids, security_group_ids, cidr)
-        
-        
-##
-## Internals
-##
-
-@lru_cache(maxsize=1)
-def _lambda_client():
-    return boto3.client('lambda')
@@ -1,13 +1,10 @@
 """ Code to retrieve information about ECS Services.
     """
 
-import boto3
-import re
-
 from collections import namedtuple
-from functools import lru_cache
 
 from ..core import FromInfo
+from ._clients import client
 from .vpc import lookup_by_subnet as vpc_lookup
 
 
@@ -16,13 +13,13 @@ def lookup_from(service_name):
         It may be passed a simple name, for services running in the default cluster, or a
         "cluster:service" identifier.
         """
-    names = re.match(r'((?P<cluster_name>[^:]+):)?(?P<service_name>.+)', service_name)
-    if not names:
+    if not service_name:
         raise Exception(f"unable to parse ECS service specification: {service_name}")
-    if names.group('cluster_name'):
-        resp = _ecs_client().describe_services(cluster=names.group('cluster_name'), services=[names.group('service_name')])
+    cluster_name, _, name = service_name.partition(':')
+    if cluster_name and name:
+        resp = client('ecs').describe_services(cluster=cluster_name, services=[name])
     else:
-        resp = _ecs_client().describe_services(services=[names.group('service_name')])
+        resp = client('ecs').describe_services(services=[service_name])
     if len(resp['services']) > 0:
         desc = resp['services'][0]
     else:
@@ -33,12 +30,3 @@ def lookup_from(service_name):
     vpc = vpc_lookup(subnet_ids[0])
     cidr = vpc.subnets[subnet_ids[0]].cidr
     return FromInfo("ECS", desc['serviceName'], vpc, subnet_ids, security_group_ids, cidr)
-        
-        
-##
-## Internals
-##
-
-@lru_cache(maxsize=1)
-def _ecs_client():
-    return boto3.client('ecs')
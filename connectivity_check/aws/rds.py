@@ -1,56 +1,86 @@
 """ Code to retrieve information about RDS database instances.
     """
 
-import boto3
 import sys
 
 from collections import namedtuple
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 from ..core import ToInfo
-from .vpc import lookup as vpc_lookup
+from ._clients import client, paginate
+from .vpc import lookup as vpc_lookup, lookup_subnets as vpc_lookup_subnets
 
 
 def lookup_to(rds_name):
     """ This the entry point for retrieving information about RDS as a destination.
         It may be passed either the name of an RDS instance or of a cluster. In the
         latter case it returns information for the writer instance of that cluster.
+
+        Since we don't know which it is, we concurrently ask for the instance with
+        that name, the cluster with that name, and the instances belonging to that
+        cluster; this takes one round-trip regardless of the type of name.
         """
-    try:
-        return _try_to_retrieve_instance(rds_name)
-    except:
-        try:
-            return _try_to_retrieve_cluster_instance(rds_name)
-        except:
-            raise Exception(f"failed to find RDS instance/cluster with name {rds_name}")
+    return _lookup(rds_name, endpoint_only=False)
+
+
+def lookup_endpoint_only(rds_name):
+    """ An alternative to lookup_to for callers that only need to compare VPC
+        identity and know the instance's CIDR. The returned VPC holds just the
+        first of the instance's subnets, without route tables, which takes one
+        targeted request rather than describing the entire VPC.
+        """
+    return _lookup(rds_name, endpoint_only=True)
     
         
 ##
 ## Internals
 ##
 
-@lru_cache(maxsize=1)
-def _rds_client():
-    return boto3.client('rds')
+def _lookup(rds_name, endpoint_only):
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        instances = executor.submit(_describe_instances, 'db-instance-id', rds_name)
+        cluster_instances = executor.submit(_describe_instances, 'db-cluster-id', rds_name)
+        cluster = executor.submit(_describe_cluster, rds_name)
+        if instances.result():
+            return _to_info(instances.result()[0], endpoint_only)
+        if cluster.result():
+            return _to_info(_find_writer_instance(cluster.result(), cluster_instances.result()), endpoint_only)
+    raise Exception(f"failed to find RDS instance/cluster with name {rds_name}")
 
 
-def _try_to_retrieve_instance(rds_name):
-    info = _rds_client().describe_db_instances(DBInstanceIdentifier=rds_name)['DBInstances'][0]
+def _describe_instances(filter_name, value):
+    return list(paginate('rds', 'describe_db_instances', 'DBInstances', Filters=[{'Name': filter_name, 'Values': [value]}]))
+
+
+def _describe_cluster(rds_name):
+    try:
+        return client('rds').describe_db_clusters(DBClusterIdentifier=rds_name)['DBClusters'][0]
+    except client('rds').exceptions.DBClusterNotFoundFault:
+        return None
+
+
+def _find_writer_instance(cluster_info, cluster_instances):
+    rds_name = cluster_info['DBClusterIdentifier']
+    for member in cluster_info['DBClusterMembers']:
+        if member['IsClusterWriter']:
+            instance_name = member['DBInstanceIdentifier']
+            for info in cluster_instances:
+                if info['DBInstanceIdentifier'] == instance_name:
+                    return info
+            # the writer may have been added after we listed the cluster's instances
+            return client('rds').describe_db_instances(DBInstanceIdentifier=instance_name)['DBInstances'][0]
+    raise Exception(f"cluster {rds_name} has no writer instance")
+
+
+def _to_info(info, endpoint_only):
     subnet_group = info['DBSubnetGroup']
     vpc_id = subnet_group['VpcId']
-    vpc = vpc_lookup(vpc_id)
     subnet_ids = [sn['SubnetIdentifier'] for sn in subnet_group['Subnets'] if sn['SubnetStatus'] == 'Active']
+    if not subnet_ids:
+        raise Exception(f"RDS instance {info['DBInstanceIdentifier']} has no active subnets")
+    vpc = vpc_lookup_subnets(vpc_id, subnet_ids[:1]) if endpoint_only else vpc_lookup(vpc_id)
     security_group_ids = [sg['VpcSecurityGroupId'] for sg in info['VpcSecurityGroups'] if sg['Status'] == 'active']
     cidr = vpc.subnets[subnet_ids[0]].cidr
     port = info['Endpoint']['Port']
     # FIXME - retrieve info for Vpc, Subnets, and Security Groups
-    return ToInfo('RDS', rds_name, vpc, subnet_ids, security_group_ids, cidr, port)
-
-
-
-def _try_to_retrieve_cluster_instance(rds_name):
-    cluster_info = _rds_client().describe_db_clusters(DBClusterIdentifier=rds_name)['DBClusters'][0]
-    for instance in cluster_info['DBClusterMembers']:
-        if instance['IsClusterWriter']:
-            return _try_to_retrieve_instance(instance['DBInstanceIdentifier'])
-    raise Exception(f"cluster {rds_name} has no writer instance")
+    return ToInfo('RDS', info['DBInstanceIdentifier'], vpc, subnet_ids, security_group_ids, cidr, port)
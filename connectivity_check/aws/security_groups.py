@@ -2,11 +2,14 @@
     between resources based on those groups.
     """
 
-import boto3
-import ipaddress
+import bisect
+import threading
 
+from array import array
 from collections import namedtuple
-from functools import lru_cache
+
+from . import memoize, parse_ipv4
+from ._clients import paginate
 
 ##
 ## Abstract representation of security group rules
@@ -15,6 +18,8 @@ from functools import lru_cache
 class SecurityGroupRule:
     """ Common information for ingress rules and egress rules.
         """
+
+    __slots__ = ('group_id', 'group_name', 'rule_id', 'protocol', 'from_port', 'to_port')
     
     def __init__(self, group_id, group_name, rule_id, protocol, from_port, to_port):
         self.group_id = group_id
@@ -23,62 +28,125 @@ class SecurityGroupRule:
         self.protocol = protocol
         self.from_port = 0 if from_port == -1 else from_port
         self.to_port = 65535 if to_port == -1 else to_port
-        
-    def check_port(self, dest_port):
-        # TODO - check protocol
-        dest_port = int(dest_port) # we get from args as string
-        return dest_port >= self.from_port and dest_port <= self.to_port
-        
-              
+
+
 class SecurityGroupEgressRule(SecurityGroupRule):
     """ Information/checks specific to egress rules.
         """
+
+    __slots__ = ('cidr_ipv4', 'net_ipv4', 'mask_ipv4')
     
     # TODO - support IPv6
     def __init__(self, group_id, group_name, rule_id, protocol, from_port, to_port, cidr_ipv4, cidr_ipv6):
         super().__init__(group_id, group_name, rule_id, protocol, from_port, to_port)
         self.cidr_ipv4 = cidr_ipv4
-        self.addr_ipv4 = ipaddress.ip_network(cidr_ipv4) if cidr_ipv4 else None
+        self.net_ipv4, self.mask_ipv4 = parse_ipv4(cidr_ipv4) if cidr_ipv4 else (None, None)
         
     def check(self, dest_cidr, port, evaluation):
-        if self.addr_ipv4:
-            dst_addr = ipaddress.ip_network(dest_cidr)
-            if dst_addr.subnet_of(self.addr_ipv4) and self.check_port(port):
-                return True
-            elif dst_addr.subnet_of(self.addr_ipv4):
-                evaluation.add_context(f"egress rule {self.rule_id} allows {dest_cidr} but not port {port}")
-                return False
-            else:
-                return False
+        # the caller is responsible for verifying that dest_cidr is within this rule's CIDR
+        # TODO - check protocol
+        if self.from_port <= port <= self.to_port:
+            return True
+        evaluation.add_context("egress rule {} allows {} but not port {}", self.rule_id, dest_cidr, port)
+        return False
                 
         
 class SecurityGroupIngressRule(SecurityGroupRule):
     """ Information/checks specific to ingress rules.
         """
+
+    __slots__ = ('src_group_id', 'src_cidr_ipv4', 'src_net_ipv4', 'src_mask_ipv4')
     
     # TODO - support IPv6
     def __init__(self, group_id, group_name, rule_id, protocol, from_port, to_port, src_group_id, src_cidr_ipv4, src_cidr_ipv6):
         super().__init__(group_id, group_name, rule_id, protocol, from_port, to_port)
         self.src_group_id = src_group_id
         self.src_cidr_ipv4 = src_cidr_ipv4
-        self.src_addr_ipv4 = ipaddress.ip_network(src_cidr_ipv4) if src_cidr_ipv4 else None
+        self.src_net_ipv4, self.src_mask_ipv4 = parse_ipv4(src_cidr_ipv4) if src_cidr_ipv4 else (None, None)
         
-    def check(self, src_group_id, src_cidr_ipv4, port, evaluation):
-        if self.src_group_id and src_group_id:
-            if self.src_group_id == src_group_id and self.check_port(port):
-                evaluation.mark_success(f"{self.group_id} has group-based rule {self.rule_id} that allows {src_group_id} on port {port}")
-                return True
-            elif self.src_group_id == src_group_id:
-                evaluation.add_context(f"{self.group_id} has group-based rule {self.rule_id} that allows {src_group_id} but not on port {port}")
-        if self.src_addr_ipv4 and src_cidr_ipv4:
-            src_addr_ipv4 = ipaddress.ip_network(src_cidr_ipv4)
-            if src_addr_ipv4.subnet_of(self.src_addr_ipv4) and self.check_port(port):
-                evaluation.mark_success(f"{self.group_id} has cidr-based rule {self.rule_id} that allows {src_cidr_ipv4} on port {port}")
-                return True
-            elif src_addr_ipv4.subnet_of(self.src_addr_ipv4):
-                evaluation.add_context(f"{self.group_id} has cidr-based rule {self.rule_id} that allows {src_cidr_ipv4} but not on port {port}")
+    def check_group(self, src_group_id, port, evaluation):
+        # TODO - check protocol
+        if self.src_group_id == src_group_id and self.from_port <= port <= self.to_port:
+            evaluation.mark_success(f"{self.group_id} has group-based rule {self.rule_id} that allows {src_group_id} on port {port}")
+            return True
+        elif self.src_group_id == src_group_id:
+            evaluation.add_context("{} has group-based rule {} that allows {} but not on port {}", self.group_id, self.rule_id, src_group_id, port)
         return False
 
+    def check_cidr(self, src_cidr_ipv4, port, evaluation):
+        # the caller is responsible for verifying that src_cidr_ipv4 is within this rule's CIDR
+        # TODO - check protocol
+        if self.from_port <= port <= self.to_port:
+            evaluation.mark_success(f"{self.group_id} has cidr-based rule {self.rule_id} that allows {src_cidr_ipv4} on port {port}")
+            return True
+        evaluation.add_context("{} has cidr-based rule {} that allows {} but not on port {}", self.group_id, self.rule_id, src_cidr_ipv4, port)
+        return False
+
+
+class CidrIndex:
+    """ Maps IPv4 prefixes to the rules that specify them, used to find the rules
+        whose CIDR contains an address without scanning every rule. Several rules
+        may share a prefix (eg, with different ports).
+
+        A lookup masks the address to each distinct prefix length that has been
+        added (in practice a handful, such as /0, /16, and /32) and probes the
+        dictionary with the result, which is cheaper in Python than walking a
+        trie one bit at a time.
+
+        Alongside the rules, each prefix holds parallel arrays of their port
+        ranges, so that the common question of whether any rule allows a port
+        is answered from packed integers without touching the rule objects.
+        """
+
+    def __init__(self):
+        self.rules = {}
+        self.from_ports = {}
+        self.to_ports = {}
+        self.masks = []
+
+    def insert(self, net, mask, rule):
+        if mask not in self.masks:
+            bisect.insort(self.masks, mask)
+        key = (net, mask)
+        self.rules.setdefault(key, []).append(rule)
+        self.from_ports.setdefault(key, array('H')).append(rule.from_port)
+        self.to_ports.setdefault(key, array('H')).append(rule.to_port)
+
+    def allowing(self, addr, mask, port):
+        """ Returns the first rule, from least to most specific prefix, that
+            contains the passed address/mask and allows the port, or None.
+            """
+        for prefix_mask in self.masks:
+            if prefix_mask > mask:
+                return None
+            key = (addr & prefix_mask, prefix_mask)
+            from_ports = self.from_ports.get(key)
+            if from_ports:
+                idx = _scan_port_ranges(port, from_ports, self.to_ports[key])
+                if idx >= 0:
+                    return self.rules[key][idx]
+        return None
+
+    def matching(self, addr, mask):
+        """ Yields the rules for every prefix that contains the passed address/mask,
+            from least to most specific.
+            """
+        for prefix_mask in self.masks:
+            # masks are contiguous, so numeric order is prefix-length order
+            if prefix_mask > mask:
+                return
+            yield from self.rules.get((addr & prefix_mask, prefix_mask), ())
+
+
+def _scan_port_ranges(port, from_ports, to_ports):
+    """ Returns the index of the first range in the parallel from/to arrays that
+        includes the port, or -1 if there is none.
+        """
+    for idx in range(len(from_ports)):
+        if from_ports[idx] <= port <= to_ports[idx]:
+            return idx
+    return -1
+
 
 class SecurityGroupRules:
     """ Maintains information about the ingress and egress rules for a set of
@@ -87,22 +155,53 @@ class SecurityGroupRules:
         The assumption underlying this object is that it will be used to hold
         either the egress rules for a source group, or the ingress rules for
         a destination group, not both.
+
+        Rules are accumulated by the add methods, and indexed for evaluation by
+        freeze(), which the evaluator calls as needed.
         """
 
     def __init__(self):
         self.src_group_ids = set()
         self.egress_rules = []
         self.ingress_rules = []
+        self._frozen = False
 
     def add_egress_rule(self, group_id, group_name, rule_id, protocol, from_port, to_port, cidr_ipv4, cidr_ipv6):
+        rule = SecurityGroupEgressRule(group_id, group_name, rule_id, protocol, from_port, to_port, cidr_ipv4, cidr_ipv6)
         self.src_group_ids.add(group_id)
-        self.egress_rules.append(
-            SecurityGroupEgressRule(group_id, group_name, rule_id, protocol, from_port, to_port, cidr_ipv4, cidr_ipv6))
+        self.egress_rules.append(rule)
+        self._frozen = False
         return self
 
     def add_ingress_rule(self, group_id, group_name, rule_id, protocol, from_port, to_port, src_group_id, src_cidr_ipv4, src_cidr_ipv6):
-        self.ingress_rules.append(
-            SecurityGroupIngressRule(group_id, group_name, rule_id, protocol, from_port, to_port, src_group_id, src_cidr_ipv4, src_cidr_ipv6))
+        rule = SecurityGroupIngressRule(group_id, group_name, rule_id, protocol, from_port, to_port, src_group_id, src_cidr_ipv4, src_cidr_ipv6)
+        self.ingress_rules.append(rule)
+        self._frozen = False
+        return self
+
+    def freeze(self):
+        """ Builds the indexes used to evaluate connections from the rules that
+            have been added. This is idempotent, and adding a rule afterward
+            causes the indexes to be rebuilt on next use.
+            """
+        if self._frozen:
+            return self
+        # only the port ranges are needed to evaluate 0.0.0.0/0 rules
+        self.egress_wildcard_ports = tuple((rule.from_port, rule.to_port) for rule in self.egress_rules
+                                           if rule.net_ipv4 is not None and rule.mask_ipv4 == 0)
+        self.egress_cidr_index = CidrIndex()
+        for rule in self.egress_rules:
+            if rule.net_ipv4 is not None:
+                self.egress_cidr_index.insert(rule.net_ipv4, rule.mask_ipv4, rule)
+        # ingress rules are partitioned by kind, so each is only checked against matching sources
+        self.ingress_rules_by_src_group = {}
+        self.ingress_cidr_index = CidrIndex()
+        for rule in self.ingress_rules:
+            if rule.src_group_id:
+                self.ingress_rules_by_src_group.setdefault(rule.src_group_id, []).append(rule)
+            if rule.src_net_ipv4 is not None:
+                self.ingress_cidr_index.insert(rule.src_net_ipv4, rule.src_mask_ipv4, rule)
+        self._frozen = True
         return self
 
     def can_connect_to(self, src_cidr, dest_cidr, dest_port, dest_rules):
@@ -116,35 +215,74 @@ class SecurityGroupRules:
 
             If there are multiple valid connection paths, returns one arbitrarily.
             """
-        evaluation = ConnectivityEvaluation()
-        self._check_egress_rules(dest_cidr, dest_port, evaluation)
-        if evaluation.failure:
-            return evaluation
-        self._check_ingress_rules(src_cidr, dest_port, dest_rules, evaluation)
-        return evaluation
+        return self.can_connect_to_batch([(src_cidr, dest_cidr, dest_port)], dest_rules)[0]
+
+    def can_connect_to_batch(self, connections, dest_rules):
+        """ Evaluates a sequence of (src_cidr, dest_cidr, dest_port) tuples against
+            the same destination rules, as can_connect_to does for a single
+            connection, and returns a list of the resulting evaluations in the
+            same order. Ports may be passed as ints or numeric strings.
+            """
+        self.freeze()
+        dest_rules.freeze()
+        results = []
+        for src_cidr, dest_cidr, dest_port in connections:
+            # converted once here so that rule checks can compare ints directly
+            dest_port = int(dest_port)
+            evaluation = ConnectivityEvaluation()
+            dest_addr = parse_ipv4(dest_cidr)
+            src_addr = parse_ipv4(src_cidr) if src_cidr else None
+            if self._check_egress_rules(dest_addr, dest_cidr, dest_port, evaluation):
+                self._check_ingress_rules(src_addr, src_cidr, dest_port, dest_rules, evaluation)
+            results.append(evaluation)
+        return results
     
-    def _check_egress_rules(self, dest_cidr, dest_port, evaluation):
-        for rule in self.egress_rules:
-            if rule.check(dest_cidr, dest_port, evaluation):
-                return
-        evaluation.failure = f"no egress rule allows connections to {dest_cidr} port {dest_port}"            
+    def _check_egress_rules(self, dest_addr, dest_cidr, dest_port, evaluation):
+        # most groups have an allow-all 0.0.0.0/0 egress rule, which only needs a port check
+        for from_port, to_port in self.egress_wildcard_ports:
+            if from_port <= dest_port <= to_port:
+                return True
+        if self.egress_cidr_index.allowing(*dest_addr, dest_port):
+            return True
+        # only reached if nothing allows the connection; the checks record near misses
+        for rule in self.egress_cidr_index.matching(*dest_addr):
+            rule.check(dest_cidr, dest_port, evaluation)
+        evaluation.mark_failure(f"no egress rule allows connections to {dest_cidr} port {dest_port}")
+        return False
 
-    def _check_ingress_rules(self, src_cidr, dest_port, dest_rules, evaluation):
-        for src_group_id in self.src_group_ids:
-            for rule in dest_rules.ingress_rules:
-                if rule.check(src_group_id, src_cidr, dest_port, evaluation):
+    def _check_ingress_rules(self, src_addr, src_cidr, dest_port, dest_rules, evaluation):
+        by_src_group = dest_rules.ingress_rules_by_src_group
+        for src_group_id in self.src_group_ids & by_src_group.keys():
+            for rule in by_src_group[src_group_id]:
+                if rule.check_group(src_group_id, dest_port, evaluation):
                     return
+        if src_addr:
+            rule = dest_rules.ingress_cidr_index.allowing(*src_addr, dest_port)
+            if rule:
+                rule.check_cidr(src_cidr, dest_port, evaluation)
+                return
+            for rule in dest_rules.ingress_cidr_index.matching(*src_addr):
+                rule.check_cidr(src_cidr, dest_port, evaluation)
             
 
 class ConnectivityEvaluation:
     """ Tracks the definitive success/failure of an evaluated connection,
         along with additional context for "near misses".
+
+        Context is recorded as (template, args) and only formatted when read,
+        since it is discarded whenever the connection succeeds.
         """
 
+    __slots__ = ('success', 'failure', '_context')
+
     def __init__(self):
         self.success = None
         self.failure = None
-        self.context = set()
+        self._context = set()
+
+    @property
+    def context(self):
+        return {template.format(*args) for template, args in self._context}
 
     def mark_success(self, msg):
         self.success = msg
@@ -152,40 +290,75 @@ class ConnectivityEvaluation:
     def mark_failure(self, msg):
         self.failure = msg
 
-    def add_context(self, msg):
-        self.context.add(msg)
+    def add_context(self, template, *args):
+        self._context.add((template, args))
 
 ##
 ## Retrieval of actual security group rules
 ##
 
-@lru_cache(maxsize=1)
-def _ec2_client():
-    return boto3.client('ec2')
-
-
 def lookup(security_group_ids):
     """ Given a (possibly empty) list of security groups, retrieves and combines
-        the rules associated with those groups.
+        the rules associated with those groups. The rules are taken from the
+        group descriptions themselves, so this is a single (paginated) request.
+
+        Results are cached by the set of group IDs, so repeated lookups of the
+        same groups (in any order) don't repeat the AWS requests, and group
+        descriptions are cached individually, so overlapping lookups only
+        retrieve the groups that haven't been seen; see also prefetch().
         """
+    return _lookup(frozenset(security_group_ids or ()))
+
+
+# group ID -> response from describe_security_groups; the lock is held while
+# retrieving, so concurrent prefetches don't request the same groups
+_group_descriptions = {}
+_group_descriptions_lock = threading.Lock()
+
+
+def prefetch(security_group_ids):
+    """ Retrieves the descriptions of all of the passed groups with a single request,
+        so that subsequent lookups of any subset of them (such as the source and
+        destination groups) don't need to make their own.
+        """
+    with _group_descriptions_lock:
+        missing = set(security_group_ids or ()) - _group_descriptions.keys()
+        if missing:
+            for sg in paginate('ec2', 'describe_security_groups', 'SecurityGroups', GroupIds=sorted(missing)):
+                _group_descriptions[sg['GroupId']] = sg
+
+
+@memoize
+def _lookup(security_group_ids):
     result = SecurityGroupRules()
     if not security_group_ids:
-        return result
-    for sg in _ec2_client().describe_security_groups(GroupIds=security_group_ids)['SecurityGroups']:
-        group_id = sg['GroupId']
+        return result.freeze()
+    prefetch(security_group_ids)
+    for group_id in sorted(security_group_ids):
+        sg = _group_descriptions[group_id]
         group_name = sg['GroupName']
-        for sgr in _ec2_client().describe_security_group_rules(Filters=[{'Name': 'group-id', 'Values': [group_id]}])['SecurityGroupRules']:
-            rule_id = sgr['SecurityGroupRuleId']
-            protocol = sgr['IpProtocol']
-            from_port = int(sgr['FromPort'])
-            to_port = int(sgr['ToPort'])
-            if sgr['IsEgress']:
-                cidr_ipv4 = sgr.get('CidrIpv4')
-                cidr_ipv6 = sgr.get('CidrIpv6')
-                result.add_egress_rule(group_id, group_name, rule_id, protocol, from_port, to_port, cidr_ipv4, cidr_ipv6)
-            else:
-                src_group_id = sgr.get('ReferencedGroupInfo', {}).get('GroupId')
-                src_cidr_ipv4 = sgr.get('CidrIpv4')
-                src_cidr_ipv6 = sgr.get('CidrIpv6')
-                result.add_ingress_rule(group_id, group_name, rule_id, protocol, from_port, to_port, src_group_id, src_cidr_ipv4, src_cidr_ipv6)
-    return result
\ No newline at end of file
+        for rule_id, protocol, from_port, to_port, _, cidr_ipv4, cidr_ipv6 in _permission_rules(group_id, "egress", sg.get('IpPermissionsEgress', [])):
+            result.add_egress_rule(group_id, group_name, rule_id, protocol, from_port, to_port, cidr_ipv4, cidr_ipv6)
+        for rule_id, protocol, from_port, to_port, src_group_id, src_cidr_ipv4, src_cidr_ipv6 in _permission_rules(group_id, "ingress", sg.get('IpPermissions', [])):
+            result.add_ingress_rule(group_id, group_name, rule_id, protocol, from_port, to_port, src_group_id, src_cidr_ipv4, src_cidr_ipv6)
+    # cached results may be shared between threads, so are indexed before being returned
+    return result.freeze()
+
+
+def _permission_rules(group_id, direction, permissions):
+    """ Flattens the IpPermissions structure from describe_security_groups into
+        one entry per CIDR or referenced group, which is the granularity of a
+        security group rule. Permissions don't carry rule IDs, so one is made
+        from the group ID, direction, and position.
+        """
+    idx = 0
+    for perm in permissions:
+        protocol = perm['IpProtocol']
+        from_port = int(perm.get('FromPort', -1))
+        to_port = int(perm.get('ToPort', -1))
+        entries = [(None, r['CidrIp'], None) for r in perm.get('IpRanges', [])] \
+                + [(None, None, r['CidrIpv6']) for r in perm.get('Ipv6Ranges', [])] \
+                + [(p['GroupId'], None, None) for p in perm.get('UserIdGroupPairs', [])]
+        for ref_group_id, cidr_ipv4, cidr_ipv6 in entries:
+            idx += 1
+            yield f"{group_id}/{direction}/{idx}", protocol, from_port, to_port, ref_group_id, cidr_ipv4, cidr_ipv6
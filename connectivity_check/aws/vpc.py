@@ -2,36 +2,55 @@
     connectivity to another.
     """
 
-import boto3
-import ipaddress
-
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 
 from ..core import Subnet, RouteTable
+from . import memoize, parse_ipv4
+from ._clients import client, paginate
 
 
+@memoize
 def lookup(vpc_id):
     """ Retrieves the provided VPC and related information. If passed None,
         returns a "null object" that can interact with other VPC objects.
+
+        Results are cached, since the source and destination are commonly in
+        the same VPC. The VPC, its route tables, and its subnets are retrieved
+        concurrently.
         """
     if vpc_id:
-        vpc = _describe_vpc(vpc_id)
-        route_tables_by_subnet = _describe_route_tables_by_subnet(vpc_id)
-        subnets = _describe_subnets(vpc_id, route_tables_by_subnet)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            vpc = executor.submit(_describe_vpc, vpc_id)
+            route_tables = executor.submit(_describe_route_tables_by_subnet, vpc_id)
+            subnet_descs = executor.submit(_describe_subnets, vpc_id)
+            vpc.result()
+            route_tables_by_subnet = route_tables.result()
+            subnets = _build_subnets(vpc_id, subnet_descs.result(), route_tables_by_subnet)
         return Vpc(vpc_id, subnets, route_tables_by_subnet)
     else:
         return Vpc(None, None, None)
     
     
+@memoize
 def lookup_by_subnet(subnet_id):
     """ Retrieves VPC information given the ID of one of its subnets.
         This is used to retrieve information about ECS services, which
         don't provide the VPC in their description.
         """
-    subnet_desc = _ec2_client().describe_subnets(SubnetIds=[subnet_id])['Subnets'][0]
+    subnet_desc = client('ec2').describe_subnets(SubnetIds=[subnet_id])['Subnets'][0]
     return lookup(subnet_desc['VpcId'])
 
 
+def lookup_subnets(vpc_id, subnet_ids):
+    """ Retrieves a partial VPC that holds only the specified subnets, without
+        route table information, using a single targeted request. This is for
+        callers that only need the VPC's identity and the subnets' CIDRs.
+        """
+    subnet_descs = paginate('ec2', 'describe_subnets', 'Subnets', SubnetIds=subnet_ids)
+    return Vpc(vpc_id, _build_subnets(vpc_id, subnet_descs, {}), {})
+
+
 class Vpc:
     """ Maintains information about a VPC, and methods to determine whether
         two VPCs are connected.
@@ -53,25 +72,23 @@ class Vpc:
 ## Internals
 ##
 
-@lru_cache(maxsize=1)
-def _ec2_client():
-    return boto3.client('ec2')
-
-
 @lru_cache(maxsize=1)
 def vpc_filter(vpc_id):
     return [{'Name': "vpc-id", 'Values': [vpc_id]}]
 
 
 def _describe_vpc(vpc_id):
-    vpcs = _ec2_client().describe_vpcs(VpcIds=[vpc_id])['Vpcs']
+    vpcs = client('ec2').describe_vpcs(VpcIds=[vpc_id])['Vpcs']
     return vpcs[0]
 
 
-def _describe_subnets(vpc_id, route_table_lookup):
+def _describe_subnets(vpc_id):
+    return list(paginate('ec2', 'describe_subnets', 'Subnets', Filters=vpc_filter(vpc_id)))
+
+
+def _build_subnets(vpc_id, subnets, route_table_lookup):
     result = {}
-    subnets = _ec2_client().describe_subnets(Filters=vpc_filter(vpc_id))['Subnets']
-    subnets = sorted(subnets, key=lambda s: ipaddress.IPv4Network(s['CidrBlock']))
+    subnets = sorted(subnets, key=lambda s: parse_ipv4(s['CidrBlock']))
     for subnet in subnets:
         subnet_id = subnet['SubnetId']
         cidr = subnet['CidrBlock']
@@ -85,7 +102,7 @@ def _describe_subnets(vpc_id, route_table_lookup):
 
 def _describe_route_tables_by_subnet(vpc_id):
     result = {}
-    route_tables = _ec2_client().describe_route_tables(Filters=vpc_filter(vpc_id))['RouteTables']
+    route_tables = paginate('ec2', 'describe_route_tables', 'RouteTables', Filters=vpc_filter(vpc_id))
     for rt in route_tables:
         gateway = None
         for route in rt.get('Routes', []):
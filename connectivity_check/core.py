@@ -11,7 +11,3 @@ Subnet = namedtuple('Subnet', ['vpc_id', 'subnet_id', 'cidr', 'availability_zone
 
 RouteTable = namedtuple('RouteTable', ['vpc_id', 'route_table_id', 'gateway'])
 
-SecurityGroupIngressRule = namedtuple('SecurityGroupIngressRule', ['rule_id', 'protocol', 'from_port', 'to_port', 'from_cidrv4', 'from_sg'])
-
-SecurityGroupEgressRule = namedtuple('SecurityGroupEgressRule', ['rule_id', 'protocol', 'from_port', 'to_port', 'cidr_ipv4', 'cidr_ipv6'])
-
@@ -0,0 +1,141 @@
+import pytest
+
+from botocore.exceptions import ClientError
+from unittest.mock import Mock, patch
+
+from connectivity_check.aws import rds
+
+
+def instance_desc(name, subnet_statuses=("Active",)):
+    return {
+        'DBInstanceIdentifier': name,
+        'DBSubnetGroup': {
+            'VpcId': "vpc-12345",
+            'Subnets': [{'SubnetIdentifier': f"subnet-{idx}", 'SubnetStatus': status}
+                        for idx, status in enumerate(subnet_statuses, 1)],
+        },
+        'VpcSecurityGroups': [{'VpcSecurityGroupId': "sg-67890", 'Status': "active"}],
+        'Endpoint': {'Port': 5432},
+    }
+
+
+class DBClusterNotFoundFault(ClientError):
+    pass
+
+
+def mock_client(instances=(), cluster=None, cluster_instances=(), subnets=()):
+    """ Returns a single mock that serves as both the RDS and EC2 client. The paginated
+        describe_db_instances call returns the passed instances or cluster_instances,
+        depending on its filter, and describe_subnets returns the passed subnets. If no
+        cluster is passed, describe_db_clusters raises DBClusterNotFoundFault.
+        """
+    def paginate(**kwargs):
+        if 'SubnetIds' in kwargs:
+            return [{'Subnets': list(subnets)}]
+        if kwargs['Filters'][0]['Name'] == 'db-instance-id':
+            return [{'DBInstances': list(instances)}]
+        return [{'DBInstances': list(cluster_instances)}]
+    paginator = Mock()
+    paginator.paginate.side_effect = paginate
+    result = Mock()
+    result.get_paginator.return_value = paginator
+    result.exceptions.DBClusterNotFoundFault = DBClusterNotFoundFault
+    if cluster:
+        result.describe_db_clusters.return_value = {'DBClusters': [cluster]}
+    else:
+        result.describe_db_clusters.side_effect = DBClusterNotFoundFault(
+            {'Error': {'Code': "DBClusterNotFoundFault"}}, "DescribeDBClusters")
+    return result
+
+
+def cluster_desc(name, writer_name):
+    return {
+        'DBClusterIdentifier': name,
+        'DBClusterMembers': [
+            {'DBInstanceIdentifier': f"{name}-reader", 'IsClusterWriter': False},
+            {'DBInstanceIdentifier': writer_name, 'IsClusterWriter': True},
+        ],
+    }
+
+
+def lookup_to(client, rds_name):
+    vpc = Mock()
+    vpc.subnets = {"subnet-1": Mock(cidr="172.31.128.0/20")}
+    with patch("connectivity_check.aws._clients.client", return_value=client), \
+         patch("connectivity_check.aws.rds.client", return_value=client), \
+         patch("connectivity_check.aws.rds.vpc_lookup", return_value=vpc) as vpc_lookup:
+        info = rds.lookup_to(rds_name)
+    vpc_lookup.assert_called_once_with("vpc-12345")
+    return info
+
+
+def test_lookup_to_instance():
+    client = mock_client(instances=[instance_desc("example")])
+    info = lookup_to(client, "example")
+    assert info.resource_name == "example"
+    assert info.security_group_ids == ["sg-67890"]
+    assert info.cidr == "172.31.128.0/20"
+    assert info.port == 5432
+
+
+def test_lookup_to_cluster():
+    client = mock_client(cluster=cluster_desc("example", "example-writer"),
+                         cluster_instances=[instance_desc("example-reader"), instance_desc("example-writer")])
+    info = lookup_to(client, "example")
+    assert info.resource_name == "example-writer"
+    client.describe_db_instances.assert_not_called()
+
+
+def test_lookup_to_cluster_with_writer_not_yet_listed():
+    client = mock_client(cluster=cluster_desc("example", "example-writer"),
+                         cluster_instances=[instance_desc("example-reader")])
+    client.describe_db_instances.return_value = {'DBInstances': [instance_desc("example-writer")]}
+    info = lookup_to(client, "example")
+    assert info.resource_name == "example-writer"
+    client.describe_db_instances.assert_called_once_with(DBInstanceIdentifier="example-writer")
+
+
+def test_lookup_to_cluster_without_writer():
+    cluster = cluster_desc("example", "example-writer")
+    cluster['DBClusterMembers'][1]['IsClusterWriter'] = False
+    client = mock_client(cluster=cluster, cluster_instances=[instance_desc("example-reader")])
+    with pytest.raises(Exception, match="cluster example has no writer instance"):
+        lookup_to(client, "example")
+
+
+def test_lookup_to_unknown_name():
+    client = mock_client()
+    with pytest.raises(Exception, match="failed to find RDS instance/cluster with name example"):
+        lookup_to(client, "example")
+
+
+def test_lookup_to_propagates_other_client_errors():
+    client = mock_client()
+    client.describe_db_clusters.side_effect = ClientError({'Error': {'Code': "AccessDenied"}}, "DescribeDBClusters")
+    with pytest.raises(ClientError, match="AccessDenied"):
+        lookup_to(client, "example")
+
+
+def test_lookup_endpoint_only():
+    client = mock_client(
+        instances=[instance_desc("example", ("Active", "Active"))],
+        subnets=[{'SubnetId': "subnet-1", 'CidrBlock': "172.31.128.0/20", 'AvailabilityZone': "us-east-1a"}])
+    with patch("connectivity_check.aws._clients.client", return_value=client), \
+         patch("connectivity_check.aws.rds.client", return_value=client):
+        info = rds.lookup_endpoint_only("example")
+    assert client.get_paginator.return_value.paginate.call_args.kwargs == {'SubnetIds': ["subnet-1"]}
+    assert info.vpc.vpc_id == "vpc-12345"
+    assert list(info.vpc.subnets) == ["subnet-1"]
+    assert info.subnet_ids == ["subnet-1", "subnet-2"]
+    assert info.cidr == "172.31.128.0/20"
+    assert info.port == 5432
+
+
+def test_lookup_endpoint_only_without_active_subnets():
+    client = mock_client(instances=[instance_desc("example", ("Inactive",))])
+    with patch("connectivity_check.aws._clients.client", return_value=client), \
+         patch("connectivity_check.aws.rds.client", return_value=client):
+        with pytest.raises(Exception, match="has no active subnets"):
+            rds.lookup_endpoint_only("example")
+    for call in client.get_paginator.return_value.paginate.call_args_list:
+        assert 'SubnetIds' not in call.kwargs
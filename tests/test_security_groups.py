@@ -3,7 +3,15 @@ import re
 
 from unittest.mock import Mock, patch
 
-from connectivity_check.aws.security_groups import SecurityGroupRules
+from connectivity_check.aws import security_groups
+from connectivity_check.aws import parse_ipv4
+from connectivity_check.aws.security_groups import CidrIndex, SecurityGroupEgressRule, SecurityGroupRules
+
+
+@pytest.fixture(autouse=True)
+def clear_lookup_caches():
+    security_groups._lookup.cache_clear()
+    security_groups._group_descriptions.clear()
 
 
 def test_no_ingress_rules():
@@ -89,3 +97,180 @@ def test_ingress_by_cidr_incorrect_port():
     assert result.success == None
     assert result.failure == None
     assert result.context == set(["sg-67890 has cidr-based rule sgr-67890-01 that allows 172.31.0.10/32 but not on port 3306"])
+
+
+def test_port_as_string():
+    src_rules = SecurityGroupRules() \
+                .add_egress_rule("sg-12345", "Origination", "sgr-12345-01", "tcp", 0, 65535, '0.0.0.0/0', None)
+    dst_rules = SecurityGroupRules() \
+                .add_ingress_rule("sg-67890", "Destination", "sgr-67890-01", "-1", 5432, 5432, "sg-12345", None, None)
+    result = src_rules.can_connect_to("172.31.0.10/32", "172.31.128.10/32", "5432", dst_rules)
+    assert result.success == "sg-67890 has group-based rule sgr-67890-01 that allows sg-12345 on port 5432"
+
+
+def test_ingress_by_cidr_source_wider_than_rule():
+    src_rules = SecurityGroupRules() \
+                .add_egress_rule("sg-12345", "Origination", "sgr-12345-01", "tcp", 0, 65535, '0.0.0.0/0', None)
+    dst_rules = SecurityGroupRules() \
+                .add_ingress_rule("sg-67890", "Destination", "sgr-67890-01", "-1", 5432, 5432, None, "172.31.0.0/16", None)
+    result = src_rules.can_connect_to("172.0.0.0/8", "172.31.128.10/32", 5432, dst_rules)
+    assert result.success == None
+    assert result.failure == None
+    assert result.context == set()
+
+
+def test_egress_by_more_specific_rule():
+    src_rules = SecurityGroupRules() \
+                .add_egress_rule("sg-12345", "Origination", "sgr-12345-01", "tcp", 0, 1024, '0.0.0.0/0', None) \
+                .add_egress_rule("sg-12345", "Origination", "sgr-12345-02", "tcp", 5432, 5432, '172.31.128.0/24', None) \
+                .add_egress_rule("sg-12345", "Origination", "sgr-12345-03", "tcp", 3306, 3306, '172.31.64.0/24', None)
+    dst_rules = SecurityGroupRules() \
+                .add_ingress_rule("sg-67890", "Destination", "sgr-67890-01", "-1", 5432, 5432, "sg-12345", None, None)
+    result = src_rules.can_connect_to("172.31.0.10/32", "172.31.128.10/32", 5432, dst_rules)
+    assert result.success == "sg-67890 has group-based rule sgr-67890-01 that allows sg-12345 on port 5432"
+    assert result.failure == None
+
+
+def test_ingress_by_second_source_group():
+    src_rules = SecurityGroupRules() \
+                .add_egress_rule("sg-12345", "Origination", "sgr-12345-01", "tcp", 0, 65535, '0.0.0.0/0', None) \
+                .add_egress_rule("sg-54321", "Other", "sgr-54321-01", "tcp", 0, 65535, '0.0.0.0/0', None)
+    dst_rules = SecurityGroupRules() \
+                .add_ingress_rule("sg-67890", "Destination", "sgr-67890-01", "-1", 443, 443, None, "10.0.0.0/8", None) \
+                .add_ingress_rule("sg-67890", "Destination", "sgr-67890-02", "-1", 5432, 5432, "sg-99999", None, None) \
+                .add_ingress_rule("sg-67890", "Destination", "sgr-67890-03", "-1", 5432, 5432, "sg-54321", None, None)
+    result = src_rules.can_connect_to("172.31.0.10/32", "172.31.128.10/32", 5432, dst_rules)
+    assert result.success == "sg-67890 has group-based rule sgr-67890-03 that allows sg-54321 on port 5432"
+    assert result.failure == None
+    assert result.context == set()
+
+
+def test_batch():
+    src_rules = SecurityGroupRules() \
+                .add_egress_rule("sg-12345", "Origination", "sgr-12345-01", "tcp", 0, 65535, '172.31.0.0/16', None)
+    dst_rules = SecurityGroupRules() \
+                .add_ingress_rule("sg-67890", "Destination", "sgr-67890-01", "-1", 5432, 5432, None, "172.31.0.0/16", None)
+    results = src_rules.can_connect_to_batch([("172.31.0.10/32", "172.31.128.10/32", 5432),
+                                              ("172.31.0.10/32", "172.31.128.10/32", 3306),
+                                              ("172.31.0.10/32", "10.0.0.10/32", 5432)],
+                                             dst_rules)
+    assert [r.success for r in results] == ["sg-67890 has cidr-based rule sgr-67890-01 that allows 172.31.0.10/32 on port 5432", None, None]
+    assert [r.failure for r in results] == [None, None, "no egress rule allows connections to 10.0.0.10/32 port 5432"]
+    assert results[1].context == set(["sg-67890 has cidr-based rule sgr-67890-01 that allows 172.31.0.10/32 but not on port 3306"])
+
+
+def test_rule_added_after_evaluation():
+    src_rules = SecurityGroupRules() \
+                .add_egress_rule("sg-12345", "Origination", "sgr-12345-01", "tcp", 0, 65535, '0.0.0.0/0', None)
+    dst_rules = SecurityGroupRules() \
+                .add_ingress_rule("sg-67890", "Destination", "sgr-67890-01", "-1", 5432, 5432, None, "10.0.0.0/8", None)
+    result = src_rules.can_connect_to("172.31.0.10/32", "172.31.128.10/32", 5432, dst_rules)
+    assert result.success == None
+    dst_rules.add_ingress_rule("sg-67890", "Destination", "sgr-67890-02", "-1", 5432, 5432, None, "172.31.0.0/16", None)
+    result = src_rules.can_connect_to("172.31.0.10/32", "172.31.128.10/32", 5432, dst_rules)
+    assert result.success == "sg-67890 has cidr-based rule sgr-67890-02 that allows 172.31.0.10/32 on port 5432"
+
+
+def test_group_rule_added_after_evaluation():
+    src_rules = SecurityGroupRules() \
+                .add_egress_rule("sg-12345", "Origination", "sgr-12345-01", "tcp", 0, 65535, '0.0.0.0/0', None)
+    dst_rules = SecurityGroupRules() \
+                .add_ingress_rule("sg-67890", "Destination", "sgr-67890-01", "-1", 5432, 5432, "sg-99999", None, None)
+    result = src_rules.can_connect_to("172.31.0.10/32", "172.31.128.10/32", 5432, dst_rules)
+    assert result.success == None
+    dst_rules.add_ingress_rule("sg-67890", "Destination", "sgr-67890-02", "-1", 5432, 5432, "sg-12345", None, None)
+    result = src_rules.can_connect_to("172.31.0.10/32", "172.31.128.10/32", 5432, dst_rules)
+    assert result.success == "sg-67890 has group-based rule sgr-67890-02 that allows sg-12345 on port 5432"
+
+
+def test_lookup_retrieves_rules_for_all_groups_in_one_request():
+    paginator = Mock()
+    paginator.paginate.return_value = [
+        {'SecurityGroups': [
+            {'GroupId': "sg-12345", 'GroupName': "Origination",
+             'IpPermissions': [],
+             'IpPermissionsEgress': [
+                {'IpProtocol': "-1", 'IpRanges': [{'CidrIp': "0.0.0.0/0"}], 'Ipv6Ranges': [{'CidrIpv6': "::/0"}]},
+             ]},
+        ]},
+        {'SecurityGroups': [
+            {'GroupId': "sg-67890", 'GroupName': "Destination",
+             'IpPermissions': [
+                {'IpProtocol': "tcp", 'FromPort': 5432, 'ToPort': 5432,
+                 'UserIdGroupPairs': [{'GroupId': "sg-12345", 'UserId': "123456789012"}],
+                 'IpRanges': [{'CidrIp': "172.31.0.0/16"}]},
+             ],
+             'IpPermissionsEgress': []},
+        ]},
+    ]
+    ec2 = Mock()
+    ec2.get_paginator.return_value = paginator
+    with patch("connectivity_check.aws._clients.client", return_value=ec2):
+        rules = security_groups.lookup(["sg-67890", "sg-12345"])
+    ec2.get_paginator.assert_called_once_with('describe_security_groups')
+    assert paginator.paginate.call_args.kwargs['GroupIds'] == ["sg-12345", "sg-67890"]
+    assert [(r.rule_id, r.from_port, r.to_port, r.cidr_ipv4) for r in rules.egress_rules] == [
+        ("sg-12345/egress/1", 0, 65535, "0.0.0.0/0"),
+        ("sg-12345/egress/2", 0, 65535, None),
+    ]
+    assert [(r.rule_id, r.src_group_id, r.src_cidr_ipv4) for r in rules.ingress_rules] == [
+        ("sg-67890/ingress/1", None, "172.31.0.0/16"),
+        ("sg-67890/ingress/2", "sg-12345", None),
+    ]
+    assert rules.src_group_ids == set(["sg-12345"])
+
+
+def test_prefetch_retrieves_groups_once():
+    paginator = Mock()
+    paginator.paginate.return_value = [
+        {'SecurityGroups': [
+            {'GroupId': "sg-12345", 'GroupName': "Origination", 'IpPermissions': [],
+             'IpPermissionsEgress': [{'IpProtocol': "-1", 'IpRanges': [{'CidrIp': "0.0.0.0/0"}]}]},
+            {'GroupId': "sg-67890", 'GroupName': "Destination", 'IpPermissionsEgress': [],
+             'IpPermissions': [{'IpProtocol': "tcp", 'FromPort': 5432, 'ToPort': 5432, 'UserIdGroupPairs': [{'GroupId': "sg-12345"}]}]},
+        ]},
+    ]
+    ec2 = Mock()
+    ec2.get_paginator.return_value = paginator
+    with patch("connectivity_check.aws._clients.client", return_value=ec2):
+        security_groups.prefetch(["sg-12345", "sg-67890"])
+        src_rules = security_groups.lookup(["sg-12345"])
+        dst_rules = security_groups.lookup(["sg-67890"])
+    paginator.paginate.assert_called_once()
+    result = src_rules.can_connect_to("172.31.0.10/32", "172.31.128.10/32", 5432, dst_rules)
+    assert result.success == "sg-67890 has group-based rule sg-67890/ingress/1 that allows sg-12345 on port 5432"
+
+
+def test_cidr_index_matches_containing_prefixes():
+    index = CidrIndex()
+    for cidr in ["0.0.0.0/0", "172.31.0.0/16", "172.31.128.0/24", "172.31.128.10/32", "10.0.0.0/8"]:
+        rule = SecurityGroupEgressRule("sg-12345", "Origination", cidr, "tcp", 0, 65535, cidr, None)
+        index.insert(rule.net_ipv4, rule.mask_ipv4, rule)
+    def matching(cidr):
+        return [rule.rule_id for rule in index.matching(*parse_ipv4(cidr))]
+    assert matching("172.31.128.10/32") == ["0.0.0.0/0", "172.31.0.0/16", "172.31.128.0/24", "172.31.128.10/32"]
+    assert matching("172.31.128.0/24") == ["0.0.0.0/0", "172.31.0.0/16", "172.31.128.0/24"]
+    assert matching("172.0.0.0/8") == ["0.0.0.0/0"]
+    assert matching("192.168.1.1/32") == ["0.0.0.0/0"]
+
+
+def test_cidr_index_allowing_checks_ports():
+    index = CidrIndex()
+    for rule_id, cidr, from_port, to_port in [("sgr-01", "0.0.0.0/0", 0, 1024),
+                                              ("sgr-02", "172.31.0.0/16", 3306, 3306),
+                                              ("sgr-03", "172.31.0.0/16", 5432, 5432)]:
+        rule = SecurityGroupEgressRule("sg-12345", "Origination", rule_id, "tcp", from_port, to_port, cidr, None)
+        index.insert(rule.net_ipv4, rule.mask_ipv4, rule)
+    assert index.allowing(*parse_ipv4("172.31.128.10/32"), 5432).rule_id == "sgr-03"
+    assert index.allowing(*parse_ipv4("172.31.128.10/32"), 443).rule_id == "sgr-01"
+    assert index.allowing(*parse_ipv4("10.0.0.1/32"), 5432) == None
+
+
+def test_parse_ipv4():
+    assert parse_ipv4("0.0.0.0/0") == (0, 0)
+    assert parse_ipv4("172.31.128.10/16") == (0xAC1F0000, 0xFFFF0000)
+    assert parse_ipv4("172.31.128.10") == (0xAC1F800A, 0xFFFFFFFF)
+    with pytest.raises(ValueError):
+        parse_ipv4("172.31.0.0/33")
+    with pytest.raises(ValueError):
+        parse_ipv4("172.31.0.0/-1")